@@ -1,4 +1,7 @@
 import os
+import sys
+import json
+import heapq
 import requests
 import shutil
 import threading
@@ -18,7 +21,20 @@ JS_FILE_URL = "http://soundsofdisneyland.com/sodlr/albumData.js"
 BASE_DIR = "Disneyland_Audio"
 os.makedirs(BASE_DIR, exist_ok=True)
 
-# Lock for progress bar updates
+# Files flagged as corrupt by verify_audio.py, re-fetched instead of skipped
+REFETCH_FILE = "verify_failed.txt"
+refetch_files = set()
+refetched_files = set()  # Flagged files that downloaded successfully this run
+
+# Sizes learned from previous runs, used to schedule the largest files first
+MANIFEST_FILE = "download_manifest.json"
+
+MAX_WORKERS = 25
+CHUNK_SIZE = 65536
+SEGMENT_THRESHOLD = 64 * 1024 * 1024  # Files above this are split into parallel Range requests
+SEGMENT_SIZE = 16 * 1024 * 1024
+
+# Lock for progress bar updates and the shared job queue
 lock = threading.Lock()
 
 ### Logging Function ###
@@ -29,9 +45,9 @@ def log_message(message):
         log_file.write(f"{timestamp} {message}\n")
     tqdm.write(message)  # Ensures the message does not interfere with the progress bar
 
-### 1️⃣ Download and Process a Single File ###
-def download_and_process(url, album, progress_bar):
-    """Downloads a song, converts it if needed, and ensures it's in the correct folder."""
+### 1️⃣ Prepare a Single File ###
+def prepare_download(url, album, progress_bar):
+    """Returns the destination path for a song, or None if it's already downloaded."""
     album_folder = os.path.join(BASE_DIR, sanitize_filename(album))
     os.makedirs(album_folder, exist_ok=True)
 
@@ -39,23 +55,111 @@ def download_and_process(url, album, progress_bar):
     file_path = os.path.join(album_folder, filename)
 
     if os.path.exists(file_path):
-        log_message(f"Already downloaded: {filename}")
-        progress_bar.update(1)
+        if os.path.normpath(file_path) not in refetch_files:
+            log_message(f"Already downloaded: {filename}")
+            progress_bar.update(1)
+            return None
+        # The old file stays in place until the new download replaces it
+        log_message(f"Re-fetching corrupt file: {filename}")
+
+    return file_path
+
+### 2️⃣ Download a Whole File or One Range Segment ###
+def fetch_into_part(job, part_path):
+    """Writes one job's bytes into the .part file. Returns the number of bytes received.
+
+    Returns 0 without writing and sets download["replan"] if the server
+    ignores the Range request or reports a different size than planned.
+    """
+    download = job["download"]
+    ranged = job["start"] is not None
+    headers = {"Range": f"bytes={job['start']}-{job['end'] - 1}"} if ranged else {}
+
+    response = requests.get(download["url"], headers=headers, stream=True, timeout=60)
+    if ranged and response.status_code == 200:
+        response.close()
+        download["ranges"] = False
+        download["replan"] = "server ignored the Range request"
+        return 0
+    if response.status_code != (206 if ranged else 200):
+        raise requests.RequestException(f"HTTP {response.status_code}")
+
+    # The planned segments are only valid if the server still has the size we planned for
+    if ranged:
+        total = response.headers.get("Content-Range", "").rsplit("/", 1)[-1]
+        if total != str(download["size"]):
+            response.close()
+            download["replan"] = f"size changed from {download['size']} to {total} bytes"
+            return 0
+
+    received = 0
+    with open(part_path, "r+b" if ranged else "wb") as file:
+        if ranged:
+            file.seek(job["start"])
+        for chunk in response.iter_content(CHUNK_SIZE):
+            file.write(chunk)
+            received += len(chunk)
+
+    if ranged and received != job["end"] - job["start"]:
+        raise requests.RequestException(f"segment ended after {received} bytes")
+    return received
+
+def download_job(job, progress_bar, manifest):
+    """Downloads one job into the file's .part file and finishes the file after its last segment."""
+    download = job["download"]
+    filename = os.path.basename(download["file_path"])
+    received = 0
+
+    # Skip the request if another segment already gave up on this file
+    if not download["failed"] and not download["replan"]:
+        try:
+            received = fetch_into_part(job, download["file_path"] + ".part")
+        except (requests.RequestException, OSError) as e:
+            log_message(f"Error downloading {filename}: {e}")
+            download["failed"] = True
+
+    with lock:
+        download["received"] += received
+        download["remaining"] -= 1
+        last = download["remaining"] == 0
+
+    if not last:
         return
 
-    start_time = time.time()
-    log_message(f"Downloading: {filename}")
+    # Fall back to a single whole-file request if the Range plan turned out to be wrong
+    if download["replan"] and not download["failed"]:
+        log_message(f"Re-downloading {filename} as a whole file: {download['replan']}")
+        download.update(received=0, remaining=1, replan=None)
+        download_job({"download": download, "start": None, "end": None}, progress_bar, manifest)
+        return
 
-    response = requests.get(url, stream=True)
-    file_size = 0
-    if response.status_code == 200:
-        with open(file_path, "wb") as file:
-            for chunk in response.iter_content(1024):
-                file.write(chunk)
-                file_size += len(chunk)
+    finish_download(download, progress_bar, manifest)
+
+def finish_download(download, progress_bar, manifest):
+    """Moves a completed .part file into place, then converts and files it by metadata."""
+    file_path = download["file_path"]
+    filename = os.path.basename(file_path)
+    part_path = file_path + ".part"
+
+    if not download["failed"]:
+        try:
+            os.replace(part_path, file_path)
+        except OSError as e:
+            log_message(f"Error saving {filename}: {e}")
+            download["failed"] = True
+
+    if download["failed"]:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        log_message(f"Failed: {filename}")
+        progress_bar.update(1)
+        return
 
     end_time = time.time()
-    log_message(f"Saved: {filename} ({file_size / 1024:.2f} KB) in {end_time - start_time:.2f} sec")
+    log_message(f"Saved: {filename} ({download['received'] / 1024:.2f} KB) in {end_time - download['start_time']:.2f} sec")
+
+    with lock:
+        manifest[download["url"]] = {"size": download["received"], "ranges": download["ranges"]}
 
     # Conversion Timing
     if file_path.lower().endswith(".m4a"):
@@ -66,13 +170,17 @@ def download_and_process(url, album, progress_bar):
 
     # Metadata Processing Timing
     meta_start = time.time()
-    move_file_by_metadata(file_path)
+    file_path = move_file_by_metadata(file_path)
     meta_end = time.time()
     log_message(f"Processed metadata for {filename} in {meta_end - meta_start:.2f} sec")
 
+    # verify_audio.py lists the final path, after conversion and moving
+    with lock:
+        refetched_files.add(os.path.normpath(file_path))
+
     progress_bar.update(1)
 
-### 2️⃣ Convert M4A to MP3 ###
+### 3️⃣ Convert M4A to MP3 ###
 def convert_m4a_to_mp3(file_path):
     """Converts an M4A file to MP3 while preserving metadata."""
     try:
@@ -127,6 +235,94 @@ def move_file_by_metadata(file_path):
 
     return file_path  
 
+### 5️⃣ Size-Aware Scheduling ###
+def load_manifest():
+    """Loads file sizes recorded by previous runs, keyed by URL."""
+    try:
+        with open(MANIFEST_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(manifest):
+    with open(MANIFEST_FILE, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+
+def head_size(url):
+    """Asks the server for a file's size and whether it accepts Range requests."""
+    try:
+        response = requests.head(url, allow_redirects=True, timeout=30)
+        if response.status_code == 200 and "Content-Length" in response.headers:
+            ranges = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+            return url, {"size": int(response.headers["Content-Length"]), "ranges": ranges}
+    except (requests.RequestException, ValueError):
+        pass
+    return url, None
+
+def fetch_sizes(urls, manifest):
+    """Learns sizes from the manifest of previous runs, or from concurrent HEAD requests."""
+    unknown = [url for url in urls if url not in manifest]
+    if unknown:
+        log_message(f"Requesting sizes for {len(unknown)} songs...")
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            for url, info in executor.map(head_size, unknown):
+                if info:
+                    manifest[url] = info
+    return {url: manifest.get(url) for url in urls}
+
+def plan_jobs(downloads, sizes, catalog_order=False):
+    """Builds the job queue: largest files first, with very large files split into Range segments.
+
+    Files whose size couldn't be learned are treated as the largest, so an
+    unexpectedly long track never ends up at the back of the queue.
+    Returns the queue and the per-file download state it refers to.
+    """
+    queue = []
+    planned = []
+    for index, (url, file_path) in enumerate(downloads):
+        info = sizes.get(url)
+        size = info["size"] if info else None
+        download = {
+            "url": url,
+            "file_path": file_path,
+            "size": size,
+            "ranges": bool(info and info["ranges"]),
+            "start_time": None,
+            "received": 0,
+            "remaining": 1,
+            "failed": False,
+            "replan": None,
+        }
+        planned.append(download)
+
+        if size and download["ranges"] and size > SEGMENT_THRESHOLD and not catalog_order:
+            segments = min(-(-size // SEGMENT_SIZE), MAX_WORKERS)
+            bounds = [size * i // segments for i in range(segments + 1)]
+            download["remaining"] = segments
+            with open(file_path + ".part", "wb") as file:
+                file.truncate(size)
+            for start, end in zip(bounds, bounds[1:]):
+                queue.append((-(end - start), len(queue), {"download": download, "start": start, "end": end}))
+        else:
+            priority = index if catalog_order else -(size or float("inf"))
+            queue.append((priority, len(queue), {"download": download, "start": None, "end": None}))
+
+    heapq.heapify(queue)
+    return queue, planned
+
+def run_worker(queue, progress_bar, manifest):
+    """Pulls the largest remaining job each time the worker frees up. Returns when it went idle."""
+    while True:
+        with lock:
+            if not queue:
+                return time.time()
+            _, _, job = heapq.heappop(queue)
+            download = job["download"]
+            if download["start_time"] is None:
+                download["start_time"] = time.time()
+                log_message(f"Downloading: {os.path.basename(download['file_path'])}")
+        download_job(job, progress_bar, manifest)
+
 ### Helper Functions ###
 def fetch_album_data():
     """Download albumData.js and extract MP3/M4A URLs along with album names."""
@@ -158,6 +354,23 @@ def fetch_album_data():
 
     return mp3_files
 
+def load_refetch_list():
+    """Reads the list of bad files written by verify_audio.py, if present."""
+    try:
+        with open(REFETCH_FILE, "r", encoding="utf-8") as f:
+            return {os.path.normpath(line.strip()) for line in f if line.strip()}
+    except OSError:
+        return set()
+
+def save_refetch_list():
+    """Rewrites the bad-file list without the files that were re-fetched successfully."""
+    remaining = refetch_files - refetched_files
+    if remaining == refetch_files:
+        return
+    with open(REFETCH_FILE, "w", encoding="utf-8") as f:
+        for path in sorted(remaining):
+            f.write(path + "\n")
+
 def sanitize_filename(name):
     """Remove invalid characters from filenames, but keep valid extensions."""
     if not name:
@@ -175,16 +388,38 @@ def sanitize_filename(name):
 
 ### Run Everything ###
 if __name__ == "__main__":
+    catalog_order = "--catalog-order" in sys.argv  # Plain catalog order, for comparing run times
     mp3_files = fetch_album_data()
+    refetch_files.update(load_refetch_list())
 
     if mp3_files:
         log_message(f"Downloading {len(mp3_files)} songs...\n")
 
         # Initialize tqdm progress bar
         with tqdm(total=len(mp3_files), desc="Downloading Songs", unit="song", leave=True) as progress_bar:
-            with ThreadPoolExecutor(max_workers=25) as executor:
-                futures = [executor.submit(download_and_process, mp3_url, album_name, progress_bar) for mp3_url, album_name in mp3_files]
-                for future in futures:
-                    future.result()
+            downloads = []
+            for mp3_url, album_name in mp3_files:
+                file_path = prepare_download(mp3_url, album_name, progress_bar)
+                if file_path:
+                    downloads.append((mp3_url, file_path))
+
+            manifest = load_manifest()
+            sizes = fetch_sizes([url for url, _ in downloads], manifest)
+            queue, planned = plan_jobs(downloads, sizes, catalog_order)
+
+            start_time = time.time()
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                futures = [executor.submit(run_worker, queue, progress_bar, manifest) for _ in range(MAX_WORKERS)]
+                idle_times = [future.result() for future in futures]
+            save_manifest(manifest)
+            save_refetch_list()
+
+        if downloads:
+            elapsed = max(idle_times) - start_time
+            finished = [download for download in planned if not download["failed"]]
+            total_bytes = sum(download["received"] for download in finished)
+            log_message(f"Downloaded {len(finished)} of {len(downloads)} songs ({total_bytes / 1048576:.1f} MB) in {elapsed:.2f} sec "
+                        f"({total_bytes / 1048576 / max(elapsed, 0.001):.2f} MB/s)")
+            log_message(f"Tail: {max(idle_times) - min(idle_times):.2f} sec from the first idle worker to the last")
 
 print("Task completed!")
@@ -81,7 +81,9 @@ class AudioManagerGUI(QWidget):
             ("Fix Metadata", "fix_metadata.py"),
             ("Uniform Artist", "uniform_artist.py"),
             ("Add Album Art", "add_album_art.py"),
+            ("ReplayGain", "replay_gain.py"),
             ("Remove Holiday Tracks", "remove_holiday_tracks.py"),
+            ("Verify Audio", "verify_audio.py"),
         ]
 
         # Button Layout
@@ -0,0 +1,265 @@
+import os
+import sys
+import json
+import mmap
+import base64
+import hashlib
+import argparse
+import subprocess
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+from pydub import AudioSegment
+from mutagen.mp3 import MP3
+from mutagen.id3 import ID3, TXXX
+from verify_audio import audio_bounds, find_mp3_files
+
+BASE_DIR = "Disneyland_Audio"
+CACHE_FILE = "replaygain_cache.json"
+CACHE_VERSION = 2
+
+REFERENCE_LEVEL = -14.0  # dBFS loudness that gets 0 dB of gain (89 dB SPL in ReplayGain terms)
+BLOCK_MS = 50            # RMS window length, as in ReplayGain
+CHUNK_BLOCKS = 200       # Blocks decoded per read from ffmpeg (10 seconds of audio)
+LOUD_FRACTION = 0.05     # Loudness is the level exceeded by the loudest 5% of blocks
+MIN_DB = -120.0
+BINS_PER_DB = 10
+HIST_BINS = 1201         # 0.1 dB bins from MIN_DB to 0 dBFS
+
+### 1️⃣ Content Hash ###
+def hash_track(file_path):
+    """Hashes only the audio data, so rewriting tags or album art doesn't invalidate the cache.
+
+    Returns (file_path, size, mtime, digest, error).
+    """
+    try:
+        stat = os.stat(file_path)
+        digest = hashlib.blake2b(digest_size=20)
+        if stat.st_size:
+            with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                start, end = audio_bounds(mm)
+                for pos in range(start, end, 1 << 20):
+                    digest.update(mm[pos:min(pos + (1 << 20), end)])
+        return file_path, stat.st_size, stat.st_mtime, digest.hexdigest(), None
+    except (OSError, ValueError) as e:
+        return file_path, None, None, None, str(e)
+
+### 2️⃣ Analyse a Single Track ###
+def analyze_track(file_path):
+    """Decodes a track in streaming chunks and builds its block-loudness histogram and peak."""
+    try:
+        info = MP3(file_path).info
+        sample_rate, channels = info.sample_rate, info.channels
+        block_frames = sample_rate * BLOCK_MS // 1000
+        frame_bytes = channels * 4
+
+        command = [
+            AudioSegment.converter, "-v", "error", "-i", file_path,
+            "-f", "f32le", "-acodec", "pcm_f32le", "-ac", str(channels), "-ar", str(sample_rate), "-",
+        ]
+
+        histogram = np.zeros(HIST_BINS, dtype=np.int64)
+        leftover = np.empty((0, channels), dtype=np.float32)
+        peak = 0.0
+
+        with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as process:
+            while True:
+                data = process.stdout.read(block_frames * frame_bytes * CHUNK_BLOCKS)
+                if not data:
+                    break
+
+                samples = np.frombuffer(data[:len(data) - len(data) % frame_bytes], dtype="<f4")
+                if not samples.size:
+                    continue
+                peak = max(peak, float(np.abs(samples).max()))
+
+                samples = np.concatenate((leftover, samples.reshape(-1, channels)))
+                whole = len(samples) // block_frames * block_frames
+                blocks = samples[:whole].reshape(-1, block_frames * channels)
+                leftover = samples[whole:]
+
+                # Mean square per block across all channels, then into 0.1 dB bins
+                mean_square = np.einsum("ij,ij->i", blocks, blocks, dtype=np.float64) / blocks.shape[1]
+                level = 10 * np.log10(np.maximum(mean_square, 1e-12))
+                bins = np.clip(np.round((level - MIN_DB) * BINS_PER_DB), 0, HIST_BINS - 1).astype(np.int64)
+                histogram += np.bincount(bins, minlength=HIST_BINS)
+
+        if process.returncode != 0:
+            return file_path, None, f"ffmpeg exited with code {process.returncode}"
+        if not histogram.any():
+            return file_path, None, "No audio decoded"
+
+        return file_path, {"peak": peak, **encode_histogram(histogram)}, None
+
+    except Exception as e:
+        return file_path, None, str(e)
+
+### Loudness Helpers ###
+def encode_histogram(histogram):
+    """Packs the non-empty bins and their counts as base64 strings for the JSON cache."""
+    nonzero = np.flatnonzero(histogram)
+    return {
+        "bins": base64.b64encode(nonzero.astype("<u2").tobytes()).decode("ascii"),
+        "counts": base64.b64encode(histogram[nonzero].astype("<u4").tobytes()).decode("ascii"),
+    }
+
+def to_histogram(results):
+    """Sums the sparse per-track histograms into one dense histogram."""
+    histogram = np.zeros(HIST_BINS, dtype=np.int64)
+    for result in results:
+        bins = np.frombuffer(base64.b64decode(result["bins"]), dtype="<u2")
+        counts = np.frombuffer(base64.b64decode(result["counts"]), dtype="<u4")
+        np.add.at(histogram, bins, counts)
+    return histogram
+
+def compute_gain(histogram):
+    """Returns the gain in dB that brings the histogram's loudness to REFERENCE_LEVEL."""
+    cumulative = np.cumsum(histogram[::-1])
+    index = int(np.searchsorted(cumulative, cumulative[-1] * LOUD_FRACTION))
+    loudness = MIN_DB + (HIST_BINS - 1 - index) / BINS_PER_DB
+    return REFERENCE_LEVEL - loudness
+
+### 3️⃣ Write ReplayGain Tags ###
+def replaygain_values(track_gain, track_peak, album_gain, album_peak):
+    """Formats gains and peaks as ReplayGain tag text."""
+    return {
+        "REPLAYGAIN_TRACK_GAIN": f"{track_gain:+.2f} dB",
+        "REPLAYGAIN_TRACK_PEAK": f"{track_peak:.6f}",
+        "REPLAYGAIN_ALBUM_GAIN": f"{album_gain:+.2f} dB",
+        "REPLAYGAIN_ALBUM_PEAK": f"{album_peak:.6f}",
+    }
+
+def write_replaygain_tags(file_path, values):
+    """Writes ReplayGain TXXX frames. Returns True if the file was changed."""
+    audio = MP3(file_path, ID3=ID3)
+    if audio.tags is None:
+        audio.add_tags()
+
+    changed = False
+    for desc, text in values.items():
+        frame = audio.tags.get(f"TXXX:{desc}")
+        if frame is None or frame.text[0] != text:
+            audio.tags.add(TXXX(encoding=3, desc=desc, text=text))
+            changed = True
+
+    if changed:
+        audio.save()
+    return changed
+
+### Cache Helpers ###
+def load_cache():
+    """Loads the cache: file stats -> content hash, and content hash -> analysis result."""
+    try:
+        with open(CACHE_FILE, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        if cache.get("version") == CACHE_VERSION:
+            return {"files": cache["files"], "tracks": cache["tracks"]}
+    except (OSError, ValueError, KeyError):
+        pass
+    return {"files": {}, "tracks": {}}
+
+def save_cache(cache):
+    with open(CACHE_FILE, "w", encoding="utf-8") as f:
+        json.dump({"version": CACHE_VERSION, **cache}, f)
+
+### 4️⃣ Analyse the Whole Library ###
+def apply_replaygain(base_dir=BASE_DIR, workers=None):
+    """Analyses every new or changed track in parallel and writes track and album gain tags."""
+    cache = load_cache()
+    files, tracks = cache["files"], cache["tracks"]
+    mp3_files = find_mp3_files(base_dir)
+
+    # Only re-hash files whose size or mtime changed since the last run
+    stale = set()
+    for file_path in mp3_files:
+        entry = files.get(file_path)
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            stat = None  # hash_track records the error
+        if not entry or not stat or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime:
+            stale.add(file_path)
+
+    pending = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        if stale:
+            hashes = executor.map(hash_track, sorted(stale), chunksize=8)
+            for file_path, size, mtime, digest, error in tqdm(hashes, total=len(stale), desc="Hashing", unit="song"):
+                if error:
+                    tqdm.write(f"Error reading {file_path}: {error}")
+                    files.pop(file_path, None)
+                else:
+                    files[file_path] = {"size": size, "mtime": mtime, "hash": digest}
+
+        mp3_files = [file_path for file_path in mp3_files if file_path in files]
+        cached = 0
+        for file_path in mp3_files:
+            digest = files[file_path]["hash"]
+            if digest in tracks:
+                cached += 1
+            else:
+                pending.setdefault(digest, file_path)
+
+        # Songs with identical audio share one analysis
+        print(f"Analysing {len(pending)} unique tracks for {len(mp3_files) - cached} of {len(mp3_files)} songs "
+              f"({cached} cached)...")
+        if pending:
+            digests = {file_path: digest for digest, file_path in pending.items()}
+            results = executor.map(analyze_track, list(pending.values()))
+            for file_path, result, error in tqdm(results, total=len(pending), desc="Analysing", unit="song"):
+                if error:
+                    tqdm.write(f"Error analysing {file_path}: {error}")
+                else:
+                    tracks[digests[file_path]] = result
+
+    # Album gain is computed from the combined histogram of every track in the folder
+    albums = {}
+    for file_path in mp3_files:
+        if files[file_path]["hash"] in tracks:
+            albums.setdefault(os.path.dirname(file_path), []).append(file_path)
+
+    updated = 0
+    retagged = False
+    for folder, album_files in tqdm(albums.items(), desc="Tagging", unit="album"):
+        results = [tracks[files[file_path]["hash"]] for file_path in album_files]
+        album_gain = compute_gain(to_histogram(results))
+        album_peak = max(result["peak"] for result in results)
+
+        for file_path, result in zip(album_files, results):
+            track_gain = compute_gain(to_histogram([result]))
+            values = replaygain_values(track_gain, result["peak"], album_gain, album_peak)
+
+            # Files untouched since we last tagged them don't need to be opened
+            if file_path not in stale and files[file_path].get("tags") == values:
+                continue
+            try:
+                if write_replaygain_tags(file_path, values):
+                    updated += 1
+                stat = os.stat(file_path)
+                files[file_path].update(size=stat.st_size, mtime=stat.st_mtime, tags=values)
+                retagged = True
+            except Exception as e:
+                tqdm.write(f"Error tagging {file_path}: {e}")
+
+    # Drop entries for files and audio that are no longer in the library
+    live = {file_path: files[file_path] for file_path in mp3_files}
+    live_hashes = {entry["hash"] for entry in live.values()}
+    live_tracks = {h: r for h, r in tracks.items() if h in live_hashes}
+    if stale or pending or retagged or live.keys() != cache["files"].keys() or len(live_tracks) != len(tracks):
+        save_cache({"files": live, "tracks": live_tracks})
+
+    print(f"Updated ReplayGain tags on {updated} songs.")
+
+### Run Everything ###
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute ReplayGain track and album gain for all MP3 files.")
+    parser.add_argument("base_dir", nargs="?", default=BASE_DIR, help="Library folder to scan")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.base_dir):
+        print(f"Folder not found: {args.base_dir}")
+        sys.exit(1)
+
+    apply_replaygain(args.base_dir, workers=args.workers)
+    print("Task completed!")
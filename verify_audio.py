@@ -0,0 +1,364 @@
+import os
+import sys
+import json
+import mmap
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+
+BASE_DIR = "Disneyland_Audio"
+CACHE_FILE = "verify_cache.json"
+REFETCH_FILE = "verify_failed.txt"  # Read by download_songs.py to re-fetch bad files
+
+QUICK_FRAMES = 32      # Frames walked at the start and at each sample point
+SAMPLE_POINTS = 8      # Evenly spaced sample points in quick mode
+RESYNC_WINDOW = 16384  # Bytes searched for a frame header around a sample point
+TAIL_BYTES = 65536     # Bytes at the end of the file always walked to the last frame
+SIZE_TOLERANCE = 0.01  # Allowed mismatch between the VBR header and the real audio size
+
+### MPEG Frame Header Tables ###
+BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+SAMPLE_RATES = {1: (44100, 48000, 32000), 2: (22050, 24000, 16000), 25: (11025, 12000, 8000)}
+VERSIONS = {0: 25, 2: 2, 3: 1}  # Version bits -> MPEG 2.5 / 2 / 1 (1 is reserved)
+LAYERS = {1: 3, 2: 2, 3: 1}     # Layer bits -> Layer III / II / I (0 is reserved)
+
+def build_header_table():
+    """Precomputes every frame header so the scanner only does a list lookup per frame.
+
+    The table is indexed by the second and third header bytes; entries are
+    (frame_length, samples, sample_rate, bitrate_kbps, signature) or None.
+    """
+    table = [None] * 65536
+    for b1 in range(0xE0, 0x100):
+        version = VERSIONS.get((b1 >> 3) & 0x03)
+        layer = LAYERS.get((b1 >> 1) & 0x03)
+        if version is None or layer is None:
+            continue
+
+        for b2 in range(256):
+            bitrate_index = b2 >> 4
+            rate_index = (b2 >> 2) & 0x03
+            if bitrate_index in (0, 15) or rate_index == 3:
+                continue  # Free-format and reserved values are treated as invalid
+
+            bitrate = BITRATES[(1 if version == 1 else 2, layer)][bitrate_index]
+            sample_rate = SAMPLE_RATES[version][rate_index]
+            padding = (b2 >> 1) & 0x01
+
+            if layer == 1:
+                length = (12 * bitrate * 1000 // sample_rate + padding) * 4
+                samples = 384
+            elif layer == 2 or version == 1:
+                length = 144 * bitrate * 1000 // sample_rate + padding
+                samples = 1152
+            else:
+                length = 72 * bitrate * 1000 // sample_rate + padding
+                samples = 576
+
+            table[(b1 << 8) | b2] = (length, samples, sample_rate, bitrate, (version, layer, sample_rate))
+    return table
+
+HEADER_TABLE = build_header_table()
+
+def parse_header(mm, pos):
+    """Returns the decoded frame header at pos, or None if there is no valid header."""
+    if mm[pos] != 0xFF:
+        return None
+    return HEADER_TABLE[(mm[pos + 1] << 8) | mm[pos + 2]]
+
+### Locate the Audio Region ###
+def audio_bounds(mm):
+    """Returns (start, end) of the MPEG audio data, skipping ID3v2, ID3v1, APEv2 and Lyrics3 tags."""
+    start, end = 0, len(mm)
+
+    while end - start >= 10 and mm[start:start + 3] == b"ID3":
+        tag_size = 0
+        for byte in mm[start + 6:start + 10]:
+            tag_size = (tag_size << 7) | (byte & 0x7F)
+        footer = 10 if mm[start + 5] & 0x10 else 0
+        start += 10 + tag_size + footer
+
+    while True:
+        if end - start >= 128 and mm[end - 128:end - 125] == b"TAG":
+            end -= 128
+        elif end - start >= 32 and mm[end - 32:end - 24] == b"APETAGEX":
+            tag_size = int.from_bytes(mm[end - 20:end - 16], "little")
+            has_header = int.from_bytes(mm[end - 12:end - 8], "little") & 0x80000000
+            end -= tag_size + (32 if has_header else 0)
+        elif end - start >= 15 and mm[end - 9:end] == b"LYRICS200":
+            try:
+                end -= int(mm[end - 15:end - 9]) + 15
+            except ValueError:
+                break
+        else:
+            break
+
+    return min(start, len(mm)), max(min(end, len(mm)), 0)
+
+def resync(mm, pos, end, sig=None, confirm=3):
+    """Finds the next offset where `confirm` consecutive valid frames start, or None."""
+    while True:
+        pos = mm.find(b"\xff", pos, end - 3)
+        if pos < 0:
+            return None
+
+        header = parse_header(mm, pos)
+        if header is not None and (sig is None or header[4] == sig):
+            nxt, chained = pos, 0
+            while chained < confirm:
+                h = parse_header(mm, nxt) if nxt + 3 < end else None
+                if h is None or h[4] != header[4]:
+                    break
+                nxt += h[0]
+                chained += 1
+                if nxt == end:
+                    chained = confirm  # A short chain that ends exactly at the audio end is fine
+            if chained >= confirm:
+                return pos
+        pos += 1
+
+def read_vbr_header(mm, pos, header):
+    """Reads the Xing/Info or VBRI header from the first frame. Returns (frames, bytes)."""
+    version, layer, _ = header[4]
+    if layer != 3:
+        return None, None
+
+    mono = (mm[pos + 3] >> 6) == 3
+    if version == 1:
+        side_info = 17 if mono else 32
+    else:
+        side_info = 9 if mono else 17
+    offset = pos + 4 + (0 if mm[pos + 1] & 0x01 else 2) + side_info
+
+    if mm[offset:offset + 4] in (b"Xing", b"Info"):
+        flags = int.from_bytes(mm[offset + 4:offset + 8], "big")
+        cursor = offset + 8
+        frames = size = None
+        if flags & 0x01:
+            frames = int.from_bytes(mm[cursor:cursor + 4], "big")
+            cursor += 4
+        if flags & 0x02:
+            size = int.from_bytes(mm[cursor:cursor + 4], "big")
+        return frames, size
+
+    if mm[pos + 36:pos + 40] == b"VBRI":
+        size = int.from_bytes(mm[pos + 46:pos + 50], "big")
+        frames = int.from_bytes(mm[pos + 50:pos + 54], "big")
+        return frames, size
+
+    return None, None
+
+### Frame Walking ###
+def walk(mm, pos, end, sig, limit=None):
+    """Follows the frame chain from pos. Returns (frames, samples, stop_position)."""
+    frames = samples = 0
+    while pos + 3 < end and (limit is None or frames < limit):
+        header = parse_header(mm, pos)
+        if header is None or header[4] != sig or pos + header[0] > end:
+            break
+        pos += header[0]
+        frames += 1
+        samples += header[1]
+    return frames, samples, pos
+
+def scan_to_end(mm, pos, end, sig, issues):
+    """Walks every frame from pos to end, recording sync losses, truncation and trailing garbage."""
+    frames = samples = 0
+    sync_errors = skipped = 0
+
+    while pos < end:
+        count, length, pos = walk(mm, pos, end, sig)
+        frames += count
+        samples += length
+        if pos >= end or end - pos <= 3:
+            break
+
+        header = parse_header(mm, pos)
+        if header is not None and header[4] == sig and pos + header[0] > end:
+            issues.append(f"Last frame truncated ({end - pos} of {header[0]} bytes)")
+            break
+
+        nxt = resync(mm, pos, end, sig)
+        if nxt is None:
+            issues.append(f"{end - pos} bytes of trailing garbage after last frame")
+            break
+
+        if sync_errors == 0:
+            issues.append(f"Frame sync lost at byte {pos}")
+        sync_errors += 1
+        skipped += nxt - pos
+        pos = nxt
+
+    if sync_errors > 1:
+        issues.append(f"Frame sync lost {sync_errors} times ({skipped} bytes skipped)")
+    return frames, samples
+
+### 1️⃣ Verify a Single File ###
+def verify_file(file_path, full=False):
+    """Memory-maps an MP3 and checks its frame chain without decoding any audio."""
+    result = {
+        "size": None,
+        "mtime": None,
+        "mode": "full" if full else "quick",
+        "ok": False,
+        "issues": [],
+        "duration": None,
+    }
+    issues = result["issues"]
+
+    try:
+        stat = os.stat(file_path)
+        result["size"], result["mtime"] = stat.st_size, stat.st_mtime
+        if stat.st_size == 0:
+            issues.append("Empty file")
+            return file_path, result
+
+        with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start, end = audio_bounds(mm)
+            first = resync(mm, start, end) if end - start > 3 else None
+            if first is None:
+                issues.append("No MPEG audio frames found")
+                return file_path, result
+
+            header = parse_header(mm, first)
+            sig = header[4]
+            sample_rate = sig[2]
+            vbr_frames, vbr_bytes = read_vbr_header(mm, first, header)
+            audio_bytes = end - first
+
+            if full:
+                frames, samples = scan_to_end(mm, first, end, sig, issues)
+                if vbr_frames is not None:
+                    frames -= 1  # The Xing/VBRI frame itself carries no audio
+                    samples -= header[1]
+                    if abs(frames - vbr_frames) > max(2, vbr_frames * SIZE_TOLERANCE):
+                        issues.append(f"Found {frames} frames, header expects {vbr_frames}")
+                result["duration"] = samples / sample_rate
+            else:
+                # Walks that stop inside the tail region are left to scan_to_end below
+                tail_start = max(first, end - TAIL_BYTES)
+                count, _, pos = walk(mm, first, end, sig, QUICK_FRAMES)
+                if count < QUICK_FRAMES and pos < tail_start:
+                    issues.append(f"Frame sync lost at byte {pos}")
+
+                for i in range(1, SAMPLE_POINTS + 1):
+                    offset = first + (tail_start - first) * i // (SAMPLE_POINTS + 1)
+                    if offset >= tail_start:
+                        break
+                    nxt = resync(mm, offset, min(end, offset + RESYNC_WINDOW), sig)
+                    if nxt is None:
+                        issues.append(f"No frame sync near byte {offset}")
+                        continue
+                    count, _, pos = walk(mm, nxt, end, sig, QUICK_FRAMES)
+                    if count < QUICK_FRAMES and pos < tail_start:
+                        issues.append(f"Frame sync lost at byte {pos}")
+
+                tail = resync(mm, tail_start, end, sig)
+                if tail is None:
+                    issues.append("No frame sync near end of file")
+                else:
+                    scan_to_end(mm, tail, end, sig, issues)
+
+                if vbr_frames is not None:
+                    result["duration"] = vbr_frames * header[1] / sample_rate
+                else:
+                    result["duration"] = audio_bytes * 8 / (header[3] * 1000)
+
+            # Expected duration versus file size
+            if vbr_bytes and abs(audio_bytes - vbr_bytes) > vbr_bytes * SIZE_TOLERANCE:
+                issues.append(f"Audio is {audio_bytes} bytes, header expects {vbr_bytes}")
+
+    except (OSError, ValueError, IndexError) as e:
+        issues.append(f"Could not read file: {e}")
+        return file_path, result
+
+    issues[:] = list(dict.fromkeys(issues))  # Sample walks can hit the same bad spot
+    result["ok"] = not issues
+    return file_path, result
+
+### Cache Helpers ###
+def load_cache():
+    """Loads cached results keyed by file path."""
+    try:
+        with open(CACHE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_cache(cache):
+    with open(CACHE_FILE, "w", encoding="utf-8") as f:
+        json.dump(cache, f, indent=1)
+
+def is_cached(entry, file_path, full):
+    """A cached result is reusable if size and mtime match and it was at least as thorough."""
+    if not entry:
+        return False
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return False  # verify_file records the error
+    if entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime:
+        return False
+    return entry["mode"] == "full" or not full
+
+def find_mp3_files(base_dir):
+    mp3_files = []
+    for root, _, files in os.walk(base_dir):
+        for file in files:
+            if file.lower().endswith(".mp3"):
+                mp3_files.append(os.path.normpath(os.path.join(root, file)))
+    return sorted(mp3_files)
+
+### 2️⃣ Verify the Whole Library ###
+def verify_library(base_dir=BASE_DIR, full=False, workers=None, use_cache=True):
+    """Verifies every MP3 across a process pool and writes bad files to REFETCH_FILE."""
+    cache = load_cache() if use_cache else {}
+    mp3_files = find_mp3_files(base_dir)
+    pending = [path for path in mp3_files if not is_cached(cache.get(path), path, full)]
+
+    print(f"Verifying {len(pending)} of {len(mp3_files)} files ({'full' if full else 'quick'} mode, "
+          f"{len(mp3_files) - len(pending)} cached)...")
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(verify_file, pending, [full] * len(pending), chunksize=16)
+            for file_path, result in tqdm(results, total=len(pending), desc="Verifying", unit="file"):
+                cache[file_path] = result
+                if not result["ok"]:
+                    tqdm.write(f"BAD: {file_path}: {'; '.join(result['issues'])}")
+
+    if use_cache:
+        save_cache({path: cache[path] for path in mp3_files})
+
+    bad_files = [path for path in mp3_files if not cache[path]["ok"]]
+    with open(REFETCH_FILE, "w", encoding="utf-8") as f:
+        for path in bad_files:
+            f.write(path + "\n")
+
+    print(f"{len(mp3_files) - len(bad_files)} files OK, {len(bad_files)} bad.")
+    if bad_files:
+        print(f"Bad files listed in {REFETCH_FILE}; run download_songs.py to re-fetch them.")
+    return bad_files
+
+### Run Everything ###
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check MP3 files for truncation and corruption.")
+    parser.add_argument("base_dir", nargs="?", default=BASE_DIR, help="Library folder to scan")
+    parser.add_argument("--full", action="store_true", help="Walk every frame instead of sampling")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--no-cache", action="store_true", help="Ignore and don't update the result cache")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.base_dir):
+        print(f"Folder not found: {args.base_dir}")
+        sys.exit(1)
+
+    verify_library(args.base_dir, full=args.full, workers=args.workers, use_cache=not args.no_cache)
+    print("Task completed!")